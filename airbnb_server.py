@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: airbnb_server.py
+
+Local HTTP service that keeps the cleaned Airbnb and crime datasets in memory and
+answers queries against them, so each query only pays for its own computation
+instead of reading, cleaning and indexing the csv files again.
+
+Every endpoint takes its parameters from the query string and answers with JSON:
+    /query?neighbourhood=Roxbury&accommodates=4&max_price=1000
+        the full batch mode answer (cheapest, safest and alternatives)
+    /user_pref?neighbourhood=...&accommodates=...&max_price=...
+        every matching listing
+    /lowest_cost?neighbourhood=...&accommodates=...&max_price=...
+        the cheapest matching listing
+    /safest_airbnb?neighbourhood=...&accommodates=...&max_price=...
+        the safest matching listing
+    /top?neighbourhood=...&accommodates=...&max_price=...&k=5&by=combined&price_weight=0.5
+        the best k matching listings by price, safety, crime density or a weighted combination of
+        price and safety
+    /pareto?neighbourhood=...&accommodates=...&max_price=...
+        the matching listings no other one beats on both price and safety
+    /alternative?neighbourhood=...&accommodates=...
+        average price of every neighbourhood and how the chosen one compares
+    /map.png?neighbourhood=...&accommodates=...&max_price=...
+        map of the matching listings and nearby crime reports, as a PNG image
+    /prices.png?neighbourhood=...&accommodates=...
+        graph of the average price in every other neighbourhood, as a PNG image
+    /health
+        size of the loaded datasets, when they were loaded and the hit rate of the result cache
+
+Requests are served on their own threads. A watcher thread polls the source files
+and swaps in a freshly loaded dataset when one of them changes; requests already
+running finish on the dataset they started with. Answers to /query are kept in a
+least recently used cache that the reloaded dataset takes over and empties.
+"""
+# imports necessary functions
+import argparse
+import json
+import math
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from airbnb_analysis import (Dataset, compare_locations, json_safe, lowest_cost, pareto_airbnbs, rank_airbnbs,
+                             render_map, render_prices, safest_airbnb, user_pref)
+
+
+class QueryError(ValueError):
+    """ Raised for a request that cannot be answered, carries the HTTP status """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def user_params(params, need_price=True):
+    """ Read the user choices from the query string
+    params - parsed query string (dictionary of name to list of values)
+    need_price - whether max_price is required (Default: True)
+    Return: (neighbourhood, accommodates, max_price), max_price is inf when not required
+    """
+    try:
+        location = params['neighbourhood'][0].strip().title()
+        accommodate = int(params['accommodates'][0])
+        max_price = float(params['max_price'][0]) if need_price else float('inf')
+    except KeyError as missing:
+        raise QueryError(f"missing parameter {missing}")
+    except ValueError:
+        raise QueryError("accommodates must be an integer and max_price a number")
+    if need_price and not math.isfinite(max_price):
+        raise QueryError("max_price must be a finite number")
+    return location, accommodate, max_price
+
+
+def select_listings(dataset, params):
+    """ Apply user_pref for the request, rejecting unknown neighbourhoods
+    dataset - loaded Dataset
+    params - parsed query string
+    Return: the user choices and the matching listings
+    """
+    user = user_params(params)
+    if user[0] not in dataset.locations:
+        raise QueryError(f"unknown neighbourhood {user[0]}", 404)
+    return user, user_pref(user, dataset.airbnb, dataset.listing_index)
+
+
+def listing(url, lat, long, price=None):
+    """ Describe one listing as a dictionary """
+    result = {'url': url, 'latitude': lat, 'longitude': long}
+    if price is not None:
+        result['price'] = price
+    return result
+
+
+def listings(table, extra=()):
+    """ Describe every listing of a table as a list of dictionaries
+    table - Table of listings
+    extra - further columns to include
+    """
+    return [dict(listing(table.value('listing_url', row), table.value('latitude', row),
+                         table.value('longitude', row), table.value('price', row)),
+                 **{name: table.value(name, row) for name in extra})
+            for row in range(len(table))]
+
+
+def handle_query(dataset, params):
+    user = user_params(params)
+    if user[0] not in dataset.locations:
+        raise QueryError(f"unknown neighbourhood {user[0]}", 404)
+    return dataset.answer(user)
+
+
+def handle_user_pref(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    return {'matches': len(select_airbnb), 'listings': listings(select_airbnb)}
+
+
+def handle_lowest_cost(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    if len(select_airbnb) == 0:
+        raise QueryError("no listing matches", 404)
+    url, lat, long, price = lowest_cost(select_airbnb)
+    return listing(url, lat, long, price)
+
+
+def handle_safest_airbnb(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    if len(select_airbnb) == 0:
+        raise QueryError("no listing matches", 404)
+    return listing(*safest_airbnb(select_airbnb, None, dataset.crime_index))
+
+
+def handle_top(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    try:
+        k = int(params.get('k', ['5'])[0])
+        price_weight = float(params.get('price_weight', ['0.5'])[0])
+    except ValueError:
+        raise QueryError("k must be an integer and price_weight a number")
+    if k < 1 or not 0 <= price_weight <= 1:
+        raise QueryError("k must be at least 1 and price_weight between 0 and 1")
+    try:
+        ranked = rank_airbnbs(select_airbnb, None, dataset.crime_index, k, params.get('by', ['combined'])[0],
+                              price_weight)
+    except ValueError as error:
+        raise QueryError(str(error))
+    return {'matches': len(select_airbnb), 'listings': listings(ranked, ('crime_distance', 'crime_density', 'score'))}
+
+
+def handle_pareto(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    frontier = pareto_airbnbs(select_airbnb, None, dataset.crime_index)
+    return {'matches': len(select_airbnb), 'listings': listings(frontier, ('crime_distance', 'crime_density'))}
+
+
+def handle_alternative(dataset, params):
+    user = user_params(params, need_price=False)
+    if user[0] not in dataset.locations:
+        raise QueryError(f"unknown neighbourhood {user[0]}", 404)
+    location_price = dataset.stats.location_prices(dataset.locations, user[1])
+    value, similar, expensive, cheap = compare_locations(location_price, user[0])
+    return {'average_price': value, 'prices': location_price,
+            'similar': {'location': similar[0], 'price': similar[1]},
+            'expensive': {'location': expensive[0], 'price': expensive[1]},
+            'cheapest': {'location': cheap[0], 'price': cheap[1]}}
+
+
+def handle_map(dataset, params):
+    user, select_airbnb = select_listings(dataset, params)
+    if len(select_airbnb) == 0:
+        raise QueryError("no listing matches", 404)
+    # the map reads the crime densities from the precomputed heatmap
+    return render_map(select_airbnb, None, lowest_cost(select_airbnb),
+                      safest_airbnb(select_airbnb, None, dataset.crime_index), heatmap=dataset.heatmap)
+
+
+def handle_prices(dataset, params):
+    user = user_params(params, need_price=False)
+    if user[0] not in dataset.locations:
+        raise QueryError(f"unknown neighbourhood {user[0]}", 404)
+    others = [location for location in dataset.locations if location != user[0]]
+    return render_prices(dataset.stats.location_prices(others, user[1]), user)
+
+
+def handle_health(dataset, params):
+    return {'listings': len(dataset.airbnb), 'crimes': len(dataset.crimes),
+            'neighbourhoods': len(dataset.locations), 'loaded_at': dataset.loaded_at,
+            'version': dataset.version, 'result_cache': dataset.results.stats()}
+
+
+# maps each path to the function answering it
+ROUTES = {
+    '/query': handle_query,
+    '/user_pref': handle_user_pref,
+    '/lowest_cost': handle_lowest_cost,
+    '/safest_airbnb': handle_safest_airbnb,
+    '/top': handle_top,
+    '/pareto': handle_pareto,
+    '/alternative': handle_alternative,
+    '/map.png': handle_map,
+    '/prices.png': handle_prices,
+    '/health': handle_health,
+}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """ Answers GET requests by routing them to the functions in ROUTES """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path.rstrip('/') or '/')
+        # take the dataset once so a reload mid-request cannot mix two versions
+        dataset = self.server.dataset
+        try:
+            if route is None:
+                raise QueryError(f"unknown path {url.path}", 404)
+            status, body = 200, route(dataset, parse_qs(url.query))
+        except QueryError as error:
+            status, body = error.status, {'error': str(error)}
+        if isinstance(body, bytes):
+            # the image routes answer with the encoded image itself
+            self.send_body(status, body, 'image/png')
+        else:
+            self.send_json(status, body)
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(json_safe(body)).encode('utf-8'), 'application/json')
+
+    def send_body(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """ Threaded HTTP server holding the dataset every request is answered from
+    address - (host, port) to listen on, port 0 picks a free port
+    dataset - loaded Dataset
+    reload_interval - seconds between checks of the source files, 0 disables reloading
+    verbose - log every request to stderr (Default: False)
+    """
+    daemon_threads = True
+
+    def __init__(self, address, dataset, reload_interval=5.0, verbose=False):
+        super().__init__(address, QueryHandler)
+        self.dataset = dataset
+        self.verbose = verbose
+        self.reload_interval = reload_interval
+        self._stopped = threading.Event()
+        if reload_interval > 0:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def reload(self):
+        """ Load the sources again and swap the new dataset in
+        Return: True if the new dataset is in use
+        """
+        old = self.dataset
+        try:
+            dataset = Dataset(**old.options(), workers=old.workers, recorder=old.recorder)
+        except (OSError, ValueError, KeyError) as error:
+            # a half written file keeps the old data in service until the next check
+            print(f"reload failed, keeping current data: {error}", file=sys.stderr)
+            return False
+        # keep the cache and its statistics, the new dataset version empties it on first use
+        dataset.results = old.results
+        self.dataset = dataset
+        return True
+
+    def _watch(self):
+        """ Poll the source files and reload when they change """
+        while not self._stopped.wait(self.reload_interval):
+            if self.dataset.changed():
+                self.reload()
+
+    def server_close(self):
+        self._stopped.set()
+        super().server_close()
+
+
+def serve(host='127.0.0.1', port=8000, dataset=None, reload_interval=5.0, verbose=False, cache_size=None):
+    """ Create a server ready to be run with serve_forever
+    host, port - address to listen on, port 0 picks a free port
+    dataset - loaded Dataset (Default: Dataset() from the working directory)
+    reload_interval - seconds between checks of the source files, 0 disables reloading
+    verbose - log every request to stderr
+    cache_size - most /query answers cached, 0 disables the cache (Default: RESULT_CACHE_SIZE)
+    Return: the QueryServer, its server_address holds the actual port
+    """
+    if dataset is None:
+        dataset = Dataset()
+    if cache_size is not None:
+        dataset.results.maxsize = cache_size
+    return QueryServer((host, port), dataset, reload_interval, verbose)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Airbnb queries over HTTP with the datasets kept in memory.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on")
+    parser.add_argument('--airbnb', default="airbnb_list.csv", help="airbnb listings file")
+    parser.add_argument('--crime', default="crime.csv", help="crime reports file")
+    parser.add_argument('--neighbourhoods', default="neighbourhoods.csv", help="file of neighbourhood names")
+    parser.add_argument('--delimiter', default='}', help="field delimiter of the data files")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the binary cache")
+    parser.add_argument('--reload-interval', type=float, default=5.0,
+                        help="seconds between checks of the source files, 0 disables reloading")
+    parser.add_argument('--cache-size', type=int, help="most /query answers cached, 0 disables the cache")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    dataset = Dataset(args.airbnb, args.crime, args.neighbourhoods, args.delimiter, not args.no_cache)
+    server = serve(args.host, args.port, dataset, args.reload_interval, args.verbose, args.cache_size)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
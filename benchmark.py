@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: benchmark.py
+
+Benchmark of every stage of airbnb_analysis.py on synthetic Boston-scale data.
+Writes '}' delimited Airbnb and crime files with the same headers as the real
+exports, times each stage on them and records the results as JSON, e.g.
+
+    python benchmark.py --crimes 10000 100000 1000000 --output benchmark.json
+
+Each run is appended to the output file together with the git revision, so the
+timings of the hot paths can be compared across versions.
+"""
+# imports necessary functions
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+
+from airbnb_analysis import (CrimeHeatmap, CrimeIndex, ListingIndex, PriceStats, alternative, clean_data,
+                             crime_analysis, lowest_cost, neighborhoods, read_airbnb, read_crime, render_map,
+                             render_prices, safest_airbnb, safety_scores, user_pref)
+
+# headers of the real exports, the generators write every column of them
+AIRBNB_HEADER = ('id', 'listing_url', 'name', 'description', 'neighbourhood_cleansed', 'latitude',
+                 'longitude', 'accommodates', 'price')
+CRIME_HEADER = ('INCIDENT_NUMBER', 'OFFENSE_CODE', 'OFFENSE_CODE_GROUP', 'OFFENSE_DESCRIPTION', 'DISTRICT',
+                'SHOOTING', 'OCCURRED_ON_DATE', 'YEAR', 'Lat', 'Long', 'Location')
+OFFENSE_GROUPS = ('Larceny', 'Aggravated Assault', 'Homicide', 'Verbal Disputes', 'Vandalism',
+                  'Motor Vehicle Accident Response', 'Residential Burglary', 'Simple Assault', 'Robbery')
+# extent of Boston the neighbourhood centres are spread over
+LAT_RANGE = (42.23, 42.40)
+LONG_RANGE = (-71.18, -71.00)
+# rows formatted and written at a time by the generators
+WRITE_ROWS = 100000
+
+
+def centres(locations, seed=0):
+    """ Pick a random centre for every neighbourhood
+    Return: arrays of centre latitudes and longitudes, one per location
+    """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(*LAT_RANGE, len(locations)), rng.uniform(*LONG_RANGE, len(locations))
+
+
+def generate_airbnb(filename, count, locations, seed=0):
+    """ Write a synthetic airbnb file
+    filename - file to write
+    count - number of listings
+    locations - neighbourhood names the listings are spread over
+    seed - random seed so runs are repeatable (Default: 0)
+    """
+    rng = np.random.default_rng(seed + 1)
+    lat_centres, long_centres = centres(locations, seed)
+    with open(filename, 'w') as outfile:
+        outfile.write('}'.join(AIRBNB_HEADER) + '\n')
+        for start in range(0, count, WRITE_ROWS):
+            rows = min(WRITE_ROWS, count - start)
+            place = rng.integers(0, len(locations), rows)
+            lats = lat_centres[place] + rng.normal(0, 0.005, rows)
+            longs = long_centres[place] + rng.normal(0, 0.005, rows)
+            people = rng.integers(1, 7, rows)
+            prices = rng.integers(40, 1500, rows)
+            outfile.writelines(
+                f"{start + row}}}https://www.airbnb.com/rooms/{start + row}}}Listing {start + row}}}"
+                f"A long description of listing {start + row}}}{locations[place[row]]}}}{lats[row]:.6f}}}"
+                f"{longs[row]:.6f}}}{people[row]}}}${prices[row]:,}.00\n"
+                for row in range(rows))
+
+
+def generate_crime(filename, count, locations, seed=0):
+    """ Write a synthetic crime file
+    filename - file to write
+    count - number of crime reports
+    locations - neighbourhood names the reports cluster around
+    seed - random seed so runs are repeatable (Default: 0)
+    """
+    rng = np.random.default_rng(seed + 2)
+    lat_centres, long_centres = centres(locations, seed)
+    with open(filename, 'w') as outfile:
+        outfile.write('}'.join(CRIME_HEADER) + '\n')
+        for start in range(0, count, WRITE_ROWS):
+            rows = min(WRITE_ROWS, count - start)
+            place = rng.integers(0, len(locations), rows)
+            lats = lat_centres[place] + rng.normal(0, 0.01, rows)
+            longs = long_centres[place] + rng.normal(0, 0.01, rows)
+            groups = rng.integers(0, len(OFFENSE_GROUPS), rows)
+            codes = rng.integers(100, 3000, rows)
+            outfile.writelines(
+                f"I{start + row}}}{codes[row]}}}{OFFENSE_GROUPS[groups[row]]}}}"
+                f"{OFFENSE_GROUPS[groups[row]].upper()}}}B2}}}}2022-01-01 00:00:00}}2022}}"
+                f"{lats[row]:.8f}}}{longs[row]:.8f}}}({lats[row]:.8f}, {longs[row]:.8f})\n"
+                for row in range(rows))
+
+
+def timed(function, *args):
+    """ Call function once
+    Return: (seconds taken, result)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def summary(seconds):
+    """ Describe a list of timings in milliseconds """
+    milliseconds = np.array(seconds) * 1000
+    return {'calls': len(milliseconds), 'mean_ms': round(float(milliseconds.mean()), 3),
+            'p50_ms': round(float(np.percentile(milliseconds, 50)), 3),
+            'max_ms': round(float(milliseconds.max()), 3)}
+
+
+def run_benchmark(directory, listings, crimes, locations, queries=50, seed=0):
+    """ Generate one dataset and time every stage on it
+    directory - folder the synthetic files are written to
+    listings - number of airbnb listings
+    crimes - number of crime reports
+    locations - neighbourhood names
+    queries - number of random queries the per query stages are timed over (Default: 50)
+    seed - random seed so runs are repeatable (Default: 0)
+    Return: dictionary of the dataset sizes and the timing of every stage
+    """
+    airbnb_file = os.path.join(directory, f"airbnb_{listings}.csv")
+    crime_file = os.path.join(directory, f"crime_{crimes}.csv")
+    if not os.path.exists(airbnb_file):
+        generate_airbnb(airbnb_file, listings, locations, seed)
+    if not os.path.exists(crime_file):
+        generate_crime(crime_file, crimes, locations, seed)
+
+    # stages run once per dataset load
+    stages = {}
+    seconds, airbnb = timed(read_airbnb, airbnb_file, '}')
+    stages['read_airbnb'] = summary([seconds])
+    seconds, crime_table = timed(read_crime, crime_file, '}')
+    stages['read_crime'] = summary([seconds])
+    seconds, (airbnb, crime_table) = timed(clean_data, airbnb, crime_table)
+    stages['clean_data'] = summary([seconds])
+    seconds, crime_index = timed(CrimeIndex, crime_table['x'], crime_table['y'])
+    stages['crime_index'] = summary([seconds])
+    seconds, scores = timed(safety_scores, airbnb, crime_table, crime_index)
+    stages['safety_scores'] = summary([seconds])
+    airbnb.columns.update(scores.columns)
+    seconds, heatmap = timed(CrimeHeatmap.build, crime_table, airbnb)
+    stages['crime_heatmap'] = summary([seconds])
+    airbnb['crime_density'] = heatmap.density(airbnb['x'], airbnb['y'])
+    seconds, listing_index = timed(ListingIndex, airbnb)
+    stages['listing_index'] = summary([seconds])
+    seconds, stats = timed(PriceStats, listing_index)
+    stages['price_stats'] = summary([seconds])
+
+    # stages run once per query, timed over random queries that match at least one listing
+    rng = np.random.default_rng(seed + 3)
+    per_query = {name: [] for name in ('user_pref', 'listing_index_select', 'crime_analysis', 'lowest_cost',
+                                       'safest_airbnb', 'alternative', 'render_map', 'render_map_heatmap',
+                                       'render_prices')}
+    for _ in range(queries):
+        user = (locations[rng.integers(len(locations))], int(rng.integers(1, 7)), float(rng.choice((300, 1000))))
+        # the scan without an index, then the index lookup the service and batch mode use
+        per_query['user_pref'].append(timed(user_pref, user, airbnb)[0])
+        seconds, select_airbnb = timed(listing_index.select, *user)
+        per_query['listing_index_select'].append(seconds)
+        if len(select_airbnb) == 0:
+            continue
+        seconds, crimes_refined = timed(crime_analysis, select_airbnb, crime_table)
+        per_query['crime_analysis'].append(seconds)
+        seconds, cheapest = timed(lowest_cost, select_airbnb)
+        per_query['lowest_cost'].append(seconds)
+        seconds, safest = timed(safest_airbnb, select_airbnb, crimes_refined, crime_index)
+        per_query['safest_airbnb'].append(seconds)
+        # alternative prints its report, which is not part of what is measured
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, prices = timed(alternative, airbnb, locations, user, stats)
+        per_query['alternative'].append(seconds)
+        per_query['render_map'].append(timed(render_map, select_airbnb, crimes_refined, cheapest, safest)[0])
+        # served and batch maps read the heatmap instead of the reports
+        per_query['render_map_heatmap'].append(timed(lambda: render_map(select_airbnb, None, cheapest, safest,
+                                                                        heatmap=heatmap))[0])
+        per_query['render_prices'].append(timed(render_prices, prices, user)[0])
+    stages.update((name, summary(seconds)) for name, seconds in per_query.items() if seconds)
+
+    return {'listings': listings, 'crimes': crimes, 'queries': queries, 'stages': stages}
+
+
+def environment():
+    """ Describe the code and machine the benchmark ran on """
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {'revision': revision, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'matplotlib': matplotlib.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+
+def record(filename, run):
+    """ Append a run to the JSON list of runs kept in filename """
+    runs = []
+    if os.path.exists(filename):
+        with open(filename) as infile:
+            runs = json.load(infile)
+    runs.append(run)
+    with open(filename, 'w') as outfile:
+        json.dump(runs, outfile, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every stage of airbnb_analysis.py on synthetic data.")
+    parser.add_argument('--listings', type=int, default=4000, help="number of airbnb listings")
+    parser.add_argument('--crimes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="numbers of crime reports, one benchmark per number")
+    parser.add_argument('--queries', type=int, default=50, help="random queries per benchmark")
+    parser.add_argument('--neighbourhoods', default="neighbourhoods.csv", help="file of neighbourhood names")
+    parser.add_argument('--data-dir', help="keep the generated files here instead of a temporary folder")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the data and queries")
+    parser.add_argument('--output', help="JSON file the run is appended to (Default: print it)")
+    args = parser.parse_args(argv)
+
+    locations = neighborhoods(args.neighbourhoods)
+    with contextlib.ExitStack() as stack:
+        directory = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(directory, exist_ok=True)
+        run = dict(environment(), results=[run_benchmark(directory, args.listings, crimes, locations,
+                                                          args.queries, args.seed)
+                                           for crimes in args.crimes])
+    if args.output:
+        record(args.output, run)
+    else:
+        print(json.dumps(run, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: load_test.py
+
+Load generator for airbnb_server.py. Fires random queries at a running server
+from several threads and reports throughput and latency percentiles, e.g.
+
+    python airbnb_server.py --port 8000 &
+    python load_test.py --url http://127.0.0.1:8000 --requests 2000 --concurrency 16
+"""
+# imports necessary functions
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+from airbnb_analysis import neighborhoods
+
+
+def make_paths(locations, count, endpoint='/query', seed=0):
+    """ Build random query paths
+    locations - neighbourhood names to pick from
+    count - number of paths
+    endpoint - path to query (Default: '/query')
+    seed - random seed so runs are repeatable (Default: 0)
+    Return: list of paths with query strings
+    """
+    rng = random.Random(seed)
+    return [endpoint + '?' + urlencode({'neighbourhood': rng.choice(locations),
+                                        'accommodates': rng.randint(1, 6),
+                                        'max_price': rng.choice((100, 200, 300, 500, 1000))})
+            for _ in range(count)]
+
+
+def timed_get(url, timeout=30):
+    """ Fetch one url
+    Return: (seconds taken, HTTP status or None if the request failed)
+    """
+    start = time.perf_counter()
+    try:
+        with urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        status = error.code
+    except (URLError, OSError):
+        status = None
+    return time.perf_counter() - start, status
+
+
+def run_load(base_url, paths, concurrency=8):
+    """ Send every path to the server and measure the responses
+    base_url - address of the server, e.g. http://127.0.0.1:8000
+    paths - query paths to send
+    concurrency - number of requests in flight at once (Default: 8)
+    Return: dictionary of throughput and latency statistics
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda path: timed_get(base_url + path), paths))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([seconds for seconds, _ in results]) * 1000
+    failed = sum(1 for _, status in results if status is None or status >= 500)
+    return {
+        'requests': len(paths),
+        'concurrency': concurrency,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(paths) / elapsed, 1) if elapsed else None,
+        'latency_ms': {name: round(float(np.percentile(latencies, q)), 2)
+                       for name, q in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))}
+        if len(latencies) else {},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure latency and throughput of airbnb_server.py.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="address of the server")
+    parser.add_argument('--endpoint', default='/query', help="path to query")
+    parser.add_argument('--requests', type=int, default=1000, help="number of requests to send")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at once")
+    parser.add_argument('--neighbourhoods', default="neighbourhoods.csv", help="file of neighbourhood names")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the queries")
+    args = parser.parse_args(argv)
+
+    paths = make_paths(neighborhoods(args.neighbourhoods), args.requests, args.endpoint, args.seed)
+    print(json.dumps(run_load(args.url.rstrip('/'), paths, args.concurrency), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: test_airbnb_analysis.py
+
+Equivalence checks of the incremental, indexed and vectorised paths of
+airbnb_analysis.py against plain or brute force ones, on small synthetic files
+written by benchmark.py:
+
+    python -m pytest -q test_airbnb_analysis.py
+"""
+# imports necessary functions
+import math
+import os
+
+import numpy as np
+import pytest
+
+import airbnb_analysis
+import airbnb_server
+from airbnb_analysis import (Dataset, ListingIndex, Table, answer_queries, answer_query, cached,
+                             parallel_safety_scores, safety_scores, user_pref)
+from benchmark import generate_airbnb, generate_crime
+
+LOCATIONS = ['Allston', 'Back Bay', 'Beacon Hill', 'Dorchester', 'Fenway', 'Roxbury']
+LISTINGS = 400
+CRIMES = 5000
+# price caps every neighbourhood and group size is queried with
+CAPS = (0.0, 150.0, 500.0, 1e9)
+
+
+def write_lines(filename, header, rows):
+    """ Write a data file from its header line and row lines """
+    with open(filename, 'w') as outfile:
+        outfile.write(header + '\n')
+        outfile.writelines(row + '\n' for row in rows)
+
+
+def read_lines(filename):
+    """ Read a data file as its header line and a list of row lines """
+    with open(filename) as infile:
+        lines = infile.read().splitlines()
+    return lines[0], lines[1:]
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    """ Base files, delta files and the full files holding both """
+    directory = tmp_path_factory.mktemp('data')
+    path = {name: str(directory / f"{name}.csv") for name in
+            ('airbnb_base', 'airbnb_delta', 'airbnb_full', 'crime_base', 'crime_delta', 'crime_full',
+             'neighbourhoods')}
+    with open(path['neighbourhoods'], 'w') as outfile:
+        outfile.writelines(location + '\n' for location in LOCATIONS)
+    generate_airbnb(path['airbnb_base'], LISTINGS, LOCATIONS)
+    generate_crime(path['crime_base'], CRIMES, LOCATIONS)
+    generate_crime(path['crime_delta'], CRIMES // 10, LOCATIONS, seed=7)
+
+    # the delta changes the price, size or neighbourhood of some listings and adds new ones
+    header, rows = read_lines(path['airbnb_base'])
+    rng = np.random.default_rng(3)
+    changed = {}
+    for row in rng.choice(LISTINGS, 30, replace=False).tolist():
+        fields = rows[row].split('}')
+        column = (8, 7, 4)[row % 3]
+        fields[column] = (f"${int(rng.integers(40, 900))}.00", str(int(rng.integers(1, 7))),
+                          LOCATIONS[int(rng.integers(len(LOCATIONS)))])[row % 3]
+        changed[row] = '}'.join(fields)
+    added = []
+    for new in range(20):
+        fields = rows[int(rng.integers(LISTINGS))].split('}')
+        fields[0], fields[1] = str(LISTINGS + new), f"https://www.airbnb.com/rooms/{LISTINGS + new}"
+        # moved off the copied listing, equally safe listings would only differ by rounding
+        fields[5] = f"{float(fields[5]) + rng.normal(0, 0.002):.6f}"
+        fields[6] = f"{float(fields[6]) + rng.normal(0, 0.002):.6f}"
+        added.append('}'.join(fields))
+    write_lines(path['airbnb_delta'], header, list(changed.values()) + added)
+    write_lines(path['airbnb_full'], header, [changed.get(row, line) for row, line in enumerate(rows)] + added)
+
+    header, base = read_lines(path['crime_base'])
+    write_lines(path['crime_full'], header, base + read_lines(path['crime_delta'])[1])
+    return path
+
+
+def load(files, airbnb, crime, **options):
+    """ Load a Dataset of two of the files without the binary cache """
+    return Dataset(files[airbnb], files[crime], files['neighbourhoods'], cache=False, **options)
+
+
+def assert_same(expected, actual):
+    """ Compare two answers, floats up to rounding """
+    assert expected.keys() == actual.keys()
+    for key, value in expected.items():
+        if isinstance(value, float):
+            assert actual[key] == pytest.approx(value, nan_ok=True), key
+        else:
+            assert actual[key] == value, key
+
+
+def test_deltas_match_full_load(files):
+    updated = load(files, 'airbnb_base', 'crime_base')
+    updated.apply([('crimes', files['crime_delta']), ('listings', files['airbnb_delta'])])
+    full = load(files, 'airbnb_full', 'crime_full')
+
+    assert len(updated.airbnb) == len(full.airbnb)
+    for name in full.airbnb.columns:
+        expected, actual = full.airbnb.decode(name), updated.airbnb.decode(name)
+        if expected.dtype.kind == 'f':
+            np.testing.assert_allclose(actual, expected, rtol=1e-9)
+        else:
+            np.testing.assert_array_equal(actual, expected)
+    for location in LOCATIONS:
+        for size in range(1, 7):
+            for cap in CAPS:
+                user = (location, size, cap)
+                assert_same(answer_query(full, user), answer_query(updated, user))
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_index_matches_scan(files, delta):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    if delta:
+        dataset.update_listings(files['airbnb_delta'])
+    fresh = ListingIndex(dataset.airbnb)
+    for location in LOCATIONS:
+        for size in range(1, 7):
+            for cap in CAPS + (math.nan,):
+                scan = user_pref((location, size, cap), dataset.airbnb)
+                for index in (dataset.listing_index, fresh):
+                    found = index.select(location, size, cap)
+                    assert sorted(found['id'].tolist()) == sorted(scan['id'].tolist())
+                    assert np.all(np.diff(found['price']) >= 0)
+                    assert index.count(location, size, cap) == len(scan)
+
+
+def few_values(rng, count):
+    """ A table of listings drawing price, crime_distance and crime_density from a few values,
+    so ties and duplicate listings are common """
+    return Table({'id': np.arange(count),
+                  'price': rng.choice([math.nan, 50.0, 80.0, 80.0, 120.0], count),
+                  'crime_distance': rng.choice([math.nan, math.inf, 100.0, 250.0, 250.0, 400.0], count),
+                  'crime_density': rng.choice([math.nan, 0.0, 1.5, 1.5, 4.0], count)})
+
+
+def scaled(values):
+    """ _scaled over a list, one value at a time """
+    finite = [value for value in values if math.isfinite(value)]
+    if not finite:
+        return [0.0] * len(values)
+    low, high = min(finite), max(finite)
+    return [value if math.isnan(value) else (min(max(value, low), high) - low) / (high - low) if high > low else 0.0
+            for value in values]
+
+
+@pytest.mark.parametrize('by', ['price', 'safety', 'density', 'combined'])
+def test_rank_matches_brute_force(by):
+    rng = np.random.default_rng(5)
+    for _ in range(50):
+        table = few_values(rng, int(rng.integers(1, 12)))
+        prices, distances = table['price'].tolist(), table['crime_distance'].tolist()
+        for weight in (0.0, 0.3, 1.0):
+            scores = {'price': prices, 'safety': [-distance for distance in distances],
+                      'density': table['crime_density'].tolist(),
+                      'combined': [weight * price + (1 - weight) * (1 - distance) for price, distance
+                                   in zip(scaled(prices), scaled(distances))]}[by]
+            # best score first, ties in table order
+            expected = sorted((row for row in range(len(table)) if not math.isnan(scores[row])
+                               and not math.isnan(prices[row])), key=lambda row: (scores[row], row))
+            for k in range(1, len(table) + 2):
+                ranked = airbnb_analysis.rank_airbnbs(table, k=k, by=by, price_weight=weight)
+                assert ranked['id'].tolist() == expected[:k]
+                assert ranked['score'].tolist() == [scores[row] for row in expected[:k]]
+
+
+def test_pareto_matches_brute_force():
+    rng = np.random.default_rng(9)
+    for _ in range(200):
+        table = few_values(rng, int(rng.integers(1, 12)))
+        prices, distances = table['price'].tolist(), table['crime_distance'].tolist()
+        rows = [row for row in range(len(table)) if not math.isnan(prices[row]) and not math.isnan(distances[row])]
+        # on the frontier unless another listing is as good on both and better on one, duplicates all stay
+        frontier = [row for row in rows if not any(
+            prices[other] <= prices[row] and distances[other] >= distances[row]
+            and (prices[other] < prices[row] or distances[other] > distances[row]) for other in rows)]
+        expected = sorted(frontier, key=lambda row: (prices[row], -distances[row], row))
+        assert airbnb_analysis.pareto_airbnbs(table)['id'].tolist() == expected
+
+
+def test_streamed_load_matches_full_load(files):
+    streamed = load(files, 'airbnb_base', 'crime_base', chunk_size=700)
+    full = load(files, 'airbnb_base', 'crime_base')
+    assert len(streamed.crimes) <= len(full.crimes)
+    for name in full.airbnb.columns:
+        np.testing.assert_allclose(streamed.airbnb[name], full.airbnb[name], rtol=1e-9)
+    for location in LOCATIONS:
+        for size in range(1, 7):
+            assert_same(answer_query(full, (location, size, 500.0)), answer_query(streamed, (location, size, 500.0)))
+
+
+def test_parallel_scores_match_serial(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    serial = safety_scores(dataset.airbnb, dataset.crimes, dataset.crime_index)
+    for parallel in (safety_scores(dataset.airbnb, dataset.crimes, dataset.crime_index, workers=2),
+                     parallel_safety_scores(dataset.airbnb, dataset.crimes, workers=2, shard_size=50)):
+        assert parallel.columns.keys() == serial.columns.keys()
+        for name in serial.columns:
+            assert np.array_equal(parallel[name], serial[name]), name
+
+
+def test_parallel_answers_match_serial(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    dataset.apply([('crimes', files['crime_delta']), ('listings', files['airbnb_delta'])])
+    queries = [(location, size, cap) for location in LOCATIONS + ['Nowhere'] for size in range(1, 7) for cap in CAPS]
+    serial = list(answer_queries(dataset, queries))
+    parallel = list(answer_queries(dataset, queries, workers=2, chunk_size=10))
+    assert parallel == serial
+
+
+def test_query_unknown_neighbourhood_is_not_found(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    with pytest.raises(airbnb_server.QueryError) as error:
+        airbnb_server.handle_query(dataset, {'neighbourhood': ['Nowhere'], 'accommodates': ['2'],
+                                             'max_price': ['100']})
+    assert error.value.status == 404
+
+
+def test_result_cache_shares_caps_admitting_the_same_listings(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    prices = dataset.listing_index.select('Fenway', 2)['price']
+    low = float(prices[np.flatnonzero(np.diff(prices) > 0)[0]])
+    higher = float(prices[prices > low][0])
+    first, second = dataset.answer(('Fenway', 2, low)), dataset.answer(('Fenway', 2, (low + higher) / 2))
+    assert (first['max_price'], second['max_price']) == (low, (low + higher) / 2)
+    assert dict(first, max_price=None) == dict(second, max_price=None)
+    assert dataset.answer(('Fenway', 2, higher))['matches'] > first['matches']
+    stats = dataset.results.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 2)
+
+
+def test_result_cache_evicts_the_least_recently_used(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    dataset.results = airbnb_analysis.ResultCache(maxsize=2)
+    for location in ('Allston', 'Fenway', 'Allston', 'Roxbury', 'Allston', 'Fenway'):
+        assert dataset.answer((location, 2, 500.0)) == answer_query(dataset, (location, 2, 500.0))
+    # Fenway was evicted by Roxbury, Allston stayed in use
+    stats = dataset.results.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (2, 4, 2, 2)
+
+
+def test_result_cache_of_size_zero_keeps_nothing(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    dataset.results = airbnb_analysis.ResultCache(maxsize=0)
+    for _ in range(2):
+        assert dataset.answer(('Fenway', 2, 500.0)) == answer_query(dataset, ('Fenway', 2, 500.0))
+    stats = dataset.results.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (0, 2, 0)
+
+
+@pytest.mark.parametrize('kind, delta', [('crimes', 'crime_delta'), ('listings', 'airbnb_delta')])
+def test_result_cache_is_emptied_by_deltas(files, kind, delta):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    users = [(location, 2, 500.0) for location in LOCATIONS]
+    before = [dataset.answer(user) for user in users]
+    dataset.apply([(kind, files[delta])])
+    after = [dataset.answer(user) for user in users]
+    assert after == [answer_query(dataset, user) for user in users]
+    assert after != before
+    stats = dataset.results.stats()
+    assert (stats['hits'], stats['invalidations'], stats['size']) == (0, 1, len(users))
+
+
+def test_result_cache_is_emptied_by_a_server_reload(files):
+    dataset = load(files, 'airbnb_base', 'crime_base')
+    server = airbnb_server.QueryServer(('127.0.0.1', 0), dataset, reload_interval=0)
+    try:
+        dataset.answer(('Fenway', 2, 500.0))
+        assert server.reload()
+        assert server.dataset.results is dataset.results
+        assert server.dataset.answer(('Fenway', 2, 500.0)) == dataset.answer(('Fenway', 2, 500.0))
+    finally:
+        server.server_close()
+    # the reloaded dataset emptied the cache, the old one no longer finds its answer
+    stats = dataset.results.stats()
+    assert (stats['hits'], stats['misses'], stats['invalidations']) == (0, 3, 1)
+
+
+def cache_files(tmp_path):
+    """ A small source file, its cache directory and a build counting its calls """
+    source = tmp_path / 'source.csv'
+    source.write_text('a\n1\n2\n')
+    builds = []
+
+    def build():
+        builds.append(source.read_text())
+        return Table({'a': np.array([1, 2])})
+    return str(source), str(tmp_path / 'source.csv.cache'), builds, build
+
+
+def test_cache_touched_source_is_reused(tmp_path):
+    source, path, builds, build = cache_files(tmp_path)
+    cached(path, [source], {}, build)
+    os.utime(source, ns=(0, 0))
+    assert cached(path, [source], {}, build)['a'].tolist() == [1, 2]
+    assert len(builds) == 1
+    # the refreshed signature spares the hash on the next load
+    assert airbnb_analysis.read_cache(path, [source], {}) is not None
+
+
+def test_cache_changed_source_is_rebuilt(tmp_path):
+    source, path, builds, build = cache_files(tmp_path)
+    cached(path, [source], {}, build)
+    with open(source, 'a') as outfile:
+        outfile.write('3\n')
+    cached(path, [source], {}, build)
+    assert len(builds) == 2
+
+
+def test_cache_read_only_costs_only_the_speedup(tmp_path, monkeypatch):
+    source, path, builds, build = cache_files(tmp_path)
+    cached(path, [source], {}, build)
+    os.utime(source, ns=(0, 0))
+
+    def refuse(*args, **kwargs):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(airbnb_analysis.os, 'replace', refuse)
+    monkeypatch.setattr(airbnb_analysis.os, 'rename', refuse)
+    # touched but unchanged: served from the cache although its signature cannot be refreshed
+    assert cached(path, [source], {}, build)['a'].tolist() == [1, 2]
+    assert len(builds) == 1
+    # changed: built again, and the failed swap leaves no temporary directory behind
+    with open(source, 'a') as outfile:
+        outfile.write('3\n')
+    cached(path, [source], {}, build)
+    assert len(builds) == 2
+    assert sorted(os.listdir(tmp_path)) == ['source.csv', 'source.csv.cache']
+    assert sorted(os.listdir(path)) == ['column0.npy', 'meta.json']
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([os.path.abspath(__file__), '-q']))